@@ -11,7 +11,6 @@ from mne import (
     compute_proj_evoked,
     compute_proj_raw,
     pick_types,
-    read_events,
     Epochs,
     sensitivity_map,
     read_source_estimate,
@@ -42,7 +41,6 @@ from mne.utils import _record_warnings
 
 base_dir = Path(__file__).parent.parent / "io" / "tests" / "data"
 raw_fname = base_dir / "test_raw.fif"
-event_fname = base_dir / "test-eve.fif"
 proj_fname = base_dir / "test-proj.fif"
 proj_gz_fname = base_dir / "test-proj.fif.gz"
 bads_fname = base_dir / "test_bads.txt"
@@ -51,12 +49,38 @@ fwd_fname = sample_path / "sample_audvis_trunc-meg-eeg-oct-4-fwd.fif"
 sensmap_fname = sample_path / "sample_audvis_trunc-%s-oct-4-fwd-sensmap-%s.w"
 eog_fname = sample_path / "sample_audvis_eog-proj.fif"
 ecg_fname = sample_path / "sample_audvis_ecg-proj.fif"
+raw_time = 2.5  # Do shorter amount for speed
 
 
-def test_bad_proj():
+@pytest.fixture(scope="session")
+def _raw_fif():
+    # This one is session scoped, so be sure not to modify it (use raw_fif
+    # instead)
+    return read_raw_fif(raw_fname)
+
+
+@pytest.fixture(scope="session")
+def _raw_fif_preload():
+    # This one is session scoped, so be sure not to modify it (use
+    # raw_fif_preload instead)
+    return read_raw_fif(raw_fname, preload=True)
+
+
+@pytest.fixture()
+def raw_fif(_raw_fif):
+    """Get the (non-preloaded) test raw instance."""
+    return _raw_fif.copy()
+
+
+@pytest.fixture()
+def raw_fif_preload(_raw_fif_preload):
+    """Get the preloaded test raw instance."""
+    return _raw_fif_preload.copy()
+
+
+def test_bad_proj(raw_fif, raw_fif_preload, events):
     """Test dealing with bad projection application."""
-    raw = read_raw_fif(raw_fname, preload=True)
-    events = read_events(event_fname)
+    raw = raw_fif_preload.copy()
     picks = pick_types(
         raw.info, meg=True, stim=False, ecg=False, eog=False, exclude="bads"
     )
@@ -69,13 +93,13 @@ def test_bad_proj():
     raw.info.normalize_proj()  # avoid projection warnings
     _check_warnings(raw, events, count=0)
     # eeg avg ref is okay
-    raw = read_raw_fif(raw_fname, preload=True).pick_types(meg=False, eeg=True)
+    raw = raw_fif_preload.pick_types(meg=False, eeg=True)
     raw.set_eeg_reference(projection=True)
     _check_warnings(raw, events, count=0)
     raw.info["bads"] = raw.ch_names[:10]
     _check_warnings(raw, events, count=0)
 
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif.copy()
     pytest.raises(ValueError, raw.del_proj, "foo")
     n_proj = len(raw.info["projs"])
     raw.del_proj(0)
@@ -88,14 +112,15 @@ def test_bad_proj():
     #     Projection vector "PCA-v2" has magnitude 1.00 (should be unity),
     #     applying projector with 101/306 of the original channels available
     #     may be dangerous.
-    raw = read_raw_fif(raw_fname).crop(0, 1)
+    raw = raw_fif.crop(0, 1)
     raw.set_eeg_reference(projection=True)
     raw.info["bads"] = ["MEG 0111"]
     meg_picks = pick_types(raw.info, meg=True, exclude=())
     ch_names = [raw.ch_names[pick] for pick in meg_picks]
+    ch_index = {ch_name: ii for ii, ch_name in enumerate(ch_names)}
     for p in raw.info["projs"][:-1]:
         data = np.zeros((1, len(ch_names)))
-        idx = [ch_names.index(ch_name) for ch_name in p["data"]["col_names"]]
+        idx = np.array([ch_index[ch_name] for ch_name in p["data"]["col_names"]])
         data[:, idx] = p["data"]["data"]
         p["data"].update(ncol=len(meg_picks), col_names=ch_names, data=data)
     # smoke test for no warnings during reg
@@ -119,49 +144,52 @@ def _check_warnings(raw, events, picks=None, count=3):
     assert all("dangerous" in str(ww.message) for ww in w)
 
 
-@testing.requires_testing_data
-def test_sensitivity_maps():
-    """Test sensitivity map computation."""
+@pytest.fixture(scope="module", params=[testing._pytest_param()])
+def _fwd_projs():
+    """Get the surface-oriented forward and EOG/ECG projectors."""
+    # This one is module scoped, so be sure not to modify it
     fwd = read_forward_solution(fwd_fname)
     fwd = convert_forward_solution(fwd, surf_ori=True)
     projs = read_proj(eog_fname)
     projs.extend(read_proj(ecg_fname))
-    decim = 6
-    for ch_type in ["eeg", "grad", "mag"]:
-        w = read_source_estimate(Path(str(sensmap_fname) % (ch_type, "lh"))).data
-        stc = sensitivity_map(
-            fwd, projs=None, ch_type=ch_type, mode="free", exclude="bads"
-        )
-        assert_array_almost_equal(stc.data, w, decim)
-        assert stc.subject == "sample"
-        # let's just make sure the others run
-        if ch_type == "grad":
-            # fixed (2)
-            w = read_source_estimate(str(sensmap_fname) % (ch_type, "2-lh")).data
-            stc = sensitivity_map(
-                fwd, projs=None, mode="fixed", ch_type=ch_type, exclude="bads"
-            )
-            assert_array_almost_equal(stc.data, w, decim)
-        if ch_type == "mag":
-            # ratio (3)
-            w = read_source_estimate(str(sensmap_fname) % (ch_type, "3-lh")).data
-            stc = sensitivity_map(
-                fwd, projs=None, mode="ratio", ch_type=ch_type, exclude="bads"
-            )
-            assert_array_almost_equal(stc.data, w, decim)
-        if ch_type == "eeg":
-            # radiality (4), angle (5), remaining (6), and  dampening (7)
-            modes = ["radiality", "angle", "remaining", "dampening"]
-            ends = ["4-lh", "5-lh", "6-lh", "7-lh"]
-            for mode, end in zip(modes, ends):
-                w = read_source_estimate(str(sensmap_fname) % (ch_type, end)).data
-                stc = sensitivity_map(
-                    fwd, projs=projs, mode=mode, ch_type=ch_type, exclude="bads"
-                )
-                assert_array_almost_equal(stc.data, w, decim)
+    return fwd, projs
 
+
+@testing.requires_testing_data
+@pytest.mark.parametrize(
+    "ch_type, mode, end",
+    [
+        ("eeg", "free", "lh"),
+        ("grad", "free", "lh"),
+        ("mag", "free", "lh"),
+        # fixed (2)
+        ("grad", "fixed", "2-lh"),
+        # ratio (3)
+        ("mag", "ratio", "3-lh"),
+        # radiality (4), angle (5), remaining (6), and dampening (7)
+        ("eeg", "radiality", "4-lh"),
+        ("eeg", "angle", "5-lh"),
+        ("eeg", "remaining", "6-lh"),
+        ("eeg", "dampening", "7-lh"),
+    ],
+)
+def test_sensitivity_maps(ch_type, mode, end, _fwd_projs):
+    """Test sensitivity map computation."""
+    fwd, projs = _fwd_projs
+    if mode in ("free", "fixed", "ratio"):
+        projs = None
+    w = read_source_estimate(str(sensmap_fname) % (ch_type, end)).data
+    stc = sensitivity_map(fwd, projs=projs, mode=mode, ch_type=ch_type, exclude="bads")
+    assert_array_almost_equal(stc.data, w, 6)
+    assert stc.subject == "sample"
+
+
+@testing.requires_testing_data
+def test_sensitivity_maps_corner_cases(_fwd_projs):
+    """Test sensitivity map corner cases."""
+    fwd, _ = _fwd_projs
     # test corner case for EEG
-    stc = sensitivity_map(
+    sensitivity_map(
         fwd,
         projs=[make_eeg_average_ref_proj(fwd["info"])],
         ch_type="eeg",
@@ -176,12 +204,17 @@ def test_sensitivity_maps():
     sensitivity_map(fwd)
 
 
-def test_compute_proj_epochs(tmp_path):
+def _corr(a, b):
+    """Compute the normalized dot product of two vectors."""
+    a, b = a.ravel(), b.ravel()
+    return (a @ b) / np.sqrt((a @ a) * (b @ b))
+
+
+def test_compute_proj_epochs(tmp_path, raw_fif_preload, events):
     """Test SSP computation on epochs."""
     event_id, tmin, tmax = 1, -0.2, 0.3
 
-    raw = read_raw_fif(raw_fname, preload=True)
-    events = read_events(event_fname)
+    raw = raw_fif_preload
     bad_ch = "MEG 2443"
     picks = pick_types(raw.info, meg=True, eeg=False, stim=False, eog=False, exclude=[])
     epochs = Epochs(
@@ -208,7 +241,7 @@ def test_compute_proj_epochs(tmp_path):
                 mask[bad] = False
                 p1_data = p1_data[:, mask]
                 p2_data = p2_data[:, mask]
-            corr = np.corrcoef(p1_data, p2_data)[0, 1]
+            corr = _corr(p1_data, p2_data)
             assert_array_almost_equal(corr, 1.0, 5)
             if p2["explained_var"]:
                 assert isinstance(p2["explained_var"], float)
@@ -227,11 +260,19 @@ def test_compute_proj_epochs(tmp_path):
     evoked = epochs.average()
     evoked.save(tmp_path / "foo-ave.fif")
 
-    projs = read_proj(proj_fname)
-
     projs_evoked = compute_proj_evoked(evoked, n_grad=1, n_mag=1, n_eeg=0)
     assert len(projs_evoked) == 2
     # XXX : test something
+    evoked_nan = evoked.copy()
+    evoked_nan.data[0, 0] = np.nan
+    with pytest.raises(ValueError, match="infs or NaNs"):
+        compute_proj_evoked(evoked_nan, n_grad=1, n_mag=1, n_eeg=0)
+    # NaNs in bad channels are fine, they are not used
+    evoked_nan = evoked.copy()
+    evoked_nan.info["bads"] = [bad_ch]
+    evoked_nan.data[evoked_nan.ch_names.index(bad_ch)] = np.nan
+    projs_nan = compute_proj_evoked(evoked_nan, n_grad=1, n_mag=1, n_eeg=0)
+    assert len(projs_nan) == 2
 
     # test parallelization
     projs = compute_proj_epochs(
@@ -257,32 +298,41 @@ def test_compute_proj_epochs(tmp_path):
         write_proj(fname, ["foo"], overwrite=True)
 
 
-@pytest.mark.slowtest
-def test_compute_proj_raw(tmp_path):
+@pytest.fixture(scope="module")
+def _raw_crop(_raw_fif):
+    """Get a short, preloaded raw instance for SSP computation."""
+    return _raw_fif.copy().crop(0, raw_time).load_data()
+
+
+@pytest.fixture()
+def raw_crop(_raw_crop):
+    """Get a copy of the short raw instance."""
+    return _raw_crop.copy()
+
+
+@pytest.mark.parametrize("duration", (0.25, 0.5, 1, 2))
+def test_compute_proj_raw(raw_crop, duration):
     """Test SSP computation on raw."""
     # Test that the raw projectors work
-    raw_time = 2.5  # Do shorter amount for speed
-    raw = read_raw_fif(raw_fname).crop(0, raw_time)
-    raw.load_data()
-    for ii in (0.25, 0.5, 1, 2):
-        with pytest.warns(RuntimeWarning, match="Too few samples"):
-            projs = compute_proj_raw(
-                raw, duration=ii - 0.1, stop=raw_time, n_grad=1, n_mag=1, n_eeg=0
-            )
-
-        # test that you can compute the projection matrix
-        projs = activate_proj(projs)
-        proj, nproj, U = make_projector(projs, raw.ch_names, bads=[])
-
-        assert nproj == 2
-        assert U.shape[1] == 2
-
-        # test that you can save them
-        with raw.info._unlock():
-            raw.info["projs"] += projs
-        raw.save(tmp_path / f"foo_{ii}_raw.fif", overwrite=True)
+    raw = raw_crop
+    with pytest.warns(RuntimeWarning, match="Too few samples"):
+        projs = compute_proj_raw(
+            raw, duration=duration - 0.1, stop=raw_time, n_grad=1, n_mag=1, n_eeg=0
+        )
 
+    # test that you can compute the projection matrix
+    projs = activate_proj(projs)
+    proj, nproj, U = make_projector(projs, raw.ch_names, bads=[])
+
+    assert nproj == 2
+    assert U.shape[1] == 2
+
+
+@pytest.mark.slowtest
+def test_compute_proj_raw_continuous(tmp_path, raw_crop):
+    """Test SSP computation on continuous and resampled raw."""
     # Test that purely continuous (no duration) raw projection works
+    raw = raw_crop
     with pytest.warns(RuntimeWarning, match="Too few samples"):
         projs = compute_proj_raw(
             raw, duration=None, stop=raw_time, n_grad=1, n_mag=1, n_eeg=0
@@ -298,11 +348,19 @@ def test_compute_proj_raw(tmp_path):
     # test that you can save them
     with raw.info._unlock():
         raw.info["projs"] += projs
-    raw.save(tmp_path / "foo_rawproj_continuous_raw.fif")
+    fname = tmp_path / "foo_rawproj_continuous_raw.fif"
+    raw.save(fname)
+    projs_read = read_raw_fif(fname).info["projs"]
+    assert len(projs_read) == len(raw.info["projs"])
+    for p1, p2 in zip(projs_read, raw.info["projs"]):
+        assert p1["desc"] == p2["desc"]
+        assert p1["active"] == p2["active"]
+        assert p1["data"]["col_names"] == p2["data"]["col_names"]
+        assert_allclose(p1["data"]["data"], p2["data"]["data"], rtol=1e-6)
 
     # test resampled-data projector, upsampling instead of downsampling
     # here to save an extra filtering (raw would have to be LP'ed to be equiv)
-    raw_resamp = cp.deepcopy(raw)
+    raw_resamp = raw.copy()
     raw_resamp.resample(raw.info["sfreq"] * 2, n_jobs=2, npad="auto")
     projs = compute_proj_raw(
         raw_resamp, duration=None, stop=raw_time, n_grad=1, n_mag=1, n_eeg=0
@@ -311,7 +369,11 @@ def test_compute_proj_raw(tmp_path):
     proj_new, _, _ = make_projector(projs, raw.ch_names, bads=[])
     assert_array_almost_equal(proj_new, proj, 4)
 
-    # test with bads
+
+@pytest.mark.slowtest
+def test_compute_proj_raw_bads(raw_crop):
+    """Test SSP computation on raw with bad channels."""
+    raw = raw_crop
     raw.load_bad_channels(bads_fname)  # adds 2 bad mag channels
     with pytest.warns(RuntimeWarning, match="Too few samples"):
         projs = compute_proj_raw(raw, n_grad=0, n_mag=0, n_eeg=1)
@@ -355,9 +417,25 @@ def test_proj_raw_duration(duration, sfreq):
         assert angle < 1e-5
 
 
-def test_make_eeg_average_ref_proj():
+def test_proj_partial_eig():
+    """Test that few-vector (ARPACK) and full (dense) projs agree."""
+    n_ch, n_dim = 200, 3
+    rng = np.random.RandomState(0)
+    data = np.dot(rng.randn(n_ch, n_dim) * [3, 2, 1], rng.randn(n_dim, 5000))
+    data += 1e-2 * rng.randn(n_ch, 5000)
+    raw = RawArray(data, create_info(n_ch, 1000.0, "eeg"))
+    proj_few = compute_proj_raw(raw, duration=None, n_eeg=n_dim)
+    proj_all = compute_proj_raw(raw, duration=None, n_eeg=n_ch // 4 + 1)
+    assert len(proj_few) == n_dim
+    for pf, pa in zip(proj_few, proj_all):
+        pf_data, pa_data = pf["data"]["data"], pa["data"]["data"]
+        assert_allclose(pf_data * np.sign(pf_data @ pa_data.T), pa_data, atol=1e-7)
+        assert_allclose(pf["explained_var"], pa["explained_var"])
+
+
+def test_make_eeg_average_ref_proj(raw_fif_preload):
     """Test EEG average reference projection."""
-    raw = read_raw_fif(raw_fname, preload=True)
+    raw = raw_fif_preload
     eeg = pick_types(raw.info, meg=False, eeg=True)
 
     # No average EEG reference
@@ -368,7 +446,7 @@ def test_make_eeg_average_ref_proj():
     reref = raw.copy()
     reref.add_proj(car)
     reref.apply_proj()
-    assert_array_almost_equal(reref._data[eeg].mean(axis=0), 0, decimal=18)
+    assert_allclose(reref._data[eeg].mean(axis=0), 0.0, atol=1e-18)
 
     # Error when custom reference has already been applied
     with raw.info._unlock():
@@ -385,7 +463,7 @@ def test_make_eeg_average_ref_proj():
 
 
 @pytest.mark.parametrize("ch_type", tuple(_EEG_AVREF_PICK_DICT) + ("all",))
-def test_has_eeg_average_ref_proj(ch_type):
+def test_has_eeg_average_ref_proj(ch_type, raw_fif_preload):
     """Test checking whether an (i)EEG average reference exists."""
     all_ref_ch_types = list(_EEG_AVREF_PICK_DICT)
     if ch_type == "all":
@@ -397,9 +475,8 @@ def test_has_eeg_average_ref_proj(ch_type):
     empty_info = create_info(len(all_ref_ch_types), 1000.0, ch_types)
     assert not _has_eeg_average_ref_proj(empty_info)
 
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif_preload
     raw.del_proj()
-    raw.load_data()
     picks = pick_types(raw.info, eeg=True)
     assert len(picks) == 60
     # repeat `ch_types` over and over again
@@ -447,8 +524,9 @@ def test_has_eeg_average_ref_proj(ch_type):
 
     # len(all_kinds) separate projs, with data for each channel type that
     # is a different non-zero integer (EEG=1, SEEG=2, ...)
-    for ci, ch_type in enumerate(all_ref_ch_types):
-        raw._data[pick_types(raw.info, **{ch_type: True})] = ci + 1
+    kind_picks = [pick_types(raw.info, **{kind: True}) for kind in all_ref_ch_types]
+    values = np.repeat(np.arange(1, len(kind_picks) + 1), [len(p) for p in kind_picks])
+    raw._data[np.concatenate(kind_picks)] = values[:, np.newaxis]
     for ci, ch_type in enumerate(all_ref_ch_types):
         raw.set_eeg_reference(projection=True, ch_type=ch_type)
         assert len(raw.info["projs"]) == ci + 1
@@ -478,30 +556,30 @@ def test_has_eeg_average_ref_proj(ch_type):
     assert not np.isclose(data_nz, 0.0).any()
 
 
-def test_needs_eeg_average_ref_proj():
+def test_needs_eeg_average_ref_proj(raw_fif, raw_fif_preload):
     """Test checking whether a recording needs an EEG average reference."""
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif.copy()
     assert _needs_eeg_average_ref_proj(raw.info)
 
     raw.set_eeg_reference(projection=True)
     assert not _needs_eeg_average_ref_proj(raw.info)
 
     # No EEG channels
-    raw = read_raw_fif(raw_fname, preload=True)
+    raw = raw_fif_preload
     eeg = [raw.ch_names[c] for c in pick_types(raw.info, meg=False, eeg=True)]
     raw.drop_channels(eeg)
     assert not _needs_eeg_average_ref_proj(raw.info)
 
     # Custom ref flag set
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif
     with raw.info._unlock():
         raw.info["custom_ref_applied"] = True
     assert not _needs_eeg_average_ref_proj(raw.info)
 
 
-def test_sss_proj():
+def test_sss_proj(raw_fif):
     """Test `meg` proj option."""
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif
     raw.crop(0, 1.0).load_data().pick_types(meg=True, exclude=())
     raw.pick_channels(raw.ch_names[:51]).del_proj()
     raw_sss = maxwell_filter(raw, int_order=5, ext_order=2)
@@ -526,9 +604,9 @@ def test_sss_proj():
             assert this_raw.info["projs"][3]["data"]["col_names"] == mag_names
 
 
-def test_eq_ne():
+def test_eq_ne(raw_fif):
     """Test == and != between projectors."""
-    raw = read_raw_fif(raw_fname, preload=False)
+    raw = raw_fif
     assert len(raw.info["projs"]) == 3
     raw.set_eeg_reference(projection=True)
 
@@ -544,9 +622,9 @@ def test_eq_ne():
     assert car == raw.info["projs"][3]
 
 
-def test_setup_proj():
+def test_setup_proj(raw_fif):
     """Test setup_proj."""
-    raw = read_raw_fif(raw_fname)
+    raw = raw_fif
     assert _needs_eeg_average_ref_proj(raw.info)
     raw.del_proj()
     setup_proj(raw.info)
@@ -104,3 +104,13 @@ __getattr__, __dir__, __all__ = lazy.attach(
         "_proj": ["plot_projs_joint"],
     },
 )
+
+_lazy_getattr = __getattr__
+
+
+def __getattr__(name):
+    # lazy_loader (< 0.4) does not cache resolved attributes on the package,
+    # so store them here to make later lookups plain module attribute hits
+    attr = _lazy_getattr(name)
+    globals()[name] = attr
+    return attr